@@ -1,14 +1,29 @@
+from types import MappingProxyType
+
+import pydantic_ai.messages
+
 from app.agents.databot import databot
 from app.agents.search_bot import search_bot
 
-all_agents = {
-    "search_bot": search_bot,
-    "databot": databot,
-}
+# the agents are built right here at import; these are the adapters pydantic-ai still defers
+# until the first tool return or retry prompt inside a chat, so build them now as well.
+# They are private module globals, look them up so a release without them doesn't break import
+for _name in ("tool_return_ta", "error_details_ta"):
+    _adapter = getattr(pydantic_ai.messages, _name, None)
+    if _adapter is not None:
+        _adapter.rebuild()
+
+all_agents = MappingProxyType(
+    {
+        "search_bot": search_bot,
+        "databot": databot,
+    }
+)
+_AGENT_NAMES: tuple[str, ...] = tuple(all_agents)
 
 
 def agents_list():
-    return list(all_agents.keys())
+    return _AGENT_NAMES
 
 
 def get_agent(agent_name: str):
@@ -0,0 +1,25 @@
+import os
+
+import boto3
+from botocore.config import Config
+from pydantic_ai.models.bedrock import BedrockConverseModel
+from pydantic_ai.providers.bedrock import BedrockProvider
+
+# one Bedrock client for every agent, so they share a single pool of kept-alive connections;
+# botocore's default pool of 10 would queue concurrent chat streams
+bedrock_client = boto3.client(
+    "bedrock-runtime",
+    region_name="us-east-1",
+    config=Config(
+        # same environment overrides and defaults as pydantic-ai's BedrockProvider
+        read_timeout=float(os.getenv("AWS_READ_TIMEOUT", 300)),
+        connect_timeout=float(os.getenv("AWS_CONNECT_TIMEOUT", 60)),
+        max_pool_connections=100,
+        tcp_keepalive=True,
+    ),
+)
+
+model = BedrockConverseModel(
+    "us.anthropic.claude-3-5-haiku-20241022-v1:0",
+    provider=BedrockProvider(bedrock_client=bedrock_client),
+)
@@ -0,0 +1,47 @@
+import time
+
+from duckduckgo_search import DDGS
+from pydantic_ai import Tool
+from pydantic_ai.common_tools.duckduckgo import DuckDuckGoResult, DuckDuckGoSearchTool
+
+SEARCH_CACHE_TTL = 5 * 60
+SEARCH_CACHE_SIZE = 1024
+
+
+def cached_duckduckgo_search_tool(max_results: int | None = None) -> Tool:
+    """DuckDuckGo search tool that reuses results for repeated queries for a few minutes.
+
+    The underlying search already runs in a worker thread, so only the caching is added here.
+    """
+    search = DuckDuckGoSearchTool(client=DDGS(), max_results=max_results)
+    # query -> (expires_at, results)
+    cache: dict[str, tuple[float, list[DuckDuckGoResult]]] = {}
+
+    async def duckduckgo_search(query: str) -> list[DuckDuckGoResult]:
+        """Searches DuckDuckGo for the given query and returns the results.
+
+        Args:
+            query: The query to search for.
+
+        Returns:
+            The search results.
+        """
+        now = time.monotonic()
+        cached = cache.get(query)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        results = await search(query)
+        if len(cache) >= SEARCH_CACHE_SIZE:
+            for expired in [q for q, (expires_at, _) in cache.items() if expires_at <= now]:
+                del cache[expired]
+            if len(cache) >= SEARCH_CACHE_SIZE:
+                cache.clear()
+        cache[query] = (now + SEARCH_CACHE_TTL, results)
+        return results
+
+    return Tool(
+        duckduckgo_search,
+        name="duckduckgo_search",
+        description="Searches DuckDuckGo for the given query and returns the results.",
+    )
@@ -1,20 +1,19 @@
-import uuid
-from datetime import datetime
-from typing import Annotated, Literal
+import os
+import time
+from typing import Annotated, Literal, TypedDict
 
 import fastapi
 import pydantic
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends
 from fastapi.responses import StreamingResponse
 from pydantic_ai import Agent
 from pydantic_ai.exceptions import UnexpectedModelBehavior
 from pydantic_ai.messages import (
     ModelMessage,
 )
-from typing_extensions import TypedDict
 
 from app.agents import agents_list, get_agent
-from app.db import Database, Session
+from app.db import Database, Session, get_database
 from app.login import CurrentUser, get_current_user
 
 router = APIRouter(
@@ -23,8 +22,8 @@ router = APIRouter(
 )
 
 
-async def get_db(request: Request) -> Database:
-    return request.app.state.db
+async def get_db() -> Database:
+    return get_database()
 
 
 @router.get("/chat/")
@@ -44,6 +43,15 @@ async def get_sessions(user: CurrentUser, database: Database = Depends(get_db))
     return sessions
 
 
+_CROCKFORD32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+def new_session_id() -> str:
+    """ULID: 48 bit millisecond timestamp + 80 random bits, lexicographically sortable by creation time"""
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10))
+    return "".join(_CROCKFORD32[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+
 class NewSessionRequest(pydantic.BaseModel):
     agent_name: str = "search_bot"
 
@@ -53,7 +61,7 @@ async def create_new_session(
     request: NewSessionRequest, user: CurrentUser, database: Database = Depends(get_db)
 ) -> dict[str, str]:
     """Generate a new session ID and initialize with the selected agent"""
-    session_id = f"session-{datetime.utcnow().timestamp()}-{uuid.uuid4().hex[:8]}"
+    session_id = new_session_id()
     # Create the session with the specified agent
     await database._ensure_session_exists(session_id, user, request.agent_name)
     return {"session_id": session_id, "agent_name": request.agent_name}
@@ -80,6 +88,13 @@ class ChatMessage(TypedDict):
 NodeAdapter: pydantic.TypeAdapter[ModelMessage] = pydantic.TypeAdapter(
     ModelMessage, config=pydantic.ConfigDict(defer_build=True, ser_json_bytes="base64", val_json_bytes="base64")
 )
+# build the serializer at import instead of on the first streamed node
+NodeAdapter.rebuild()
+
+
+# chat streams are per user and never worth caching by the browser or a proxy
+# (they are also left uncompressed, see ``StreamingAwareGZip`` in app.main)
+_STREAM_HEADERS = {"Cache-Control": "no-store"}
 
 
 @router.post("/chat/")
@@ -90,27 +105,29 @@ async def post_chat(
     database: Database = Depends(get_db),
 ) -> StreamingResponse:
     async def stream_messages():
-        yield (prompt.encode("utf-8") + b"\n")
-
-        agent_name = await database.get_session_agent(session_id, user)
+        # frames are newline delimited; they are buffered so that the prompt echo and the
+        # first request go out in one write, and flushed before every wait on the model or tools
+        buf = bytearray(prompt.encode("utf-8") + b"\n")
 
+        agent_name, messages = await database.get_session_context(session_id, user)
         agent = get_agent(agent_name)
-
-        messages = await database.get_messages(session_id, user)
         async with agent.iter(prompt, message_history=messages) as agent_run:
             async for node in agent_run:
                 if Agent.is_user_prompt_node(node):
                     # yield (str(node).encode("utf-8") + b"\n")
-                    pass
+                    continue
                 elif Agent.is_model_request_node(node):
-                    yield NodeAdapter.dump_json(node.request)
+                    buf += NodeAdapter.dump_json(node.request) + b"\n"
                 elif Agent.is_call_tools_node(node):
-                    yield NodeAdapter.dump_json(node.model_response)
+                    buf += NodeAdapter.dump_json(node.model_response) + b"\n"
                 elif Agent.is_end_node(node):
                     pass
                     # yield NodeAdapter.dump_json(node)
                 else:
                     raise UnexpectedModelBehavior(f"Unexpected message type for chat app: {node}")
+                if buf:
+                    yield bytes(buf)
+                    buf.clear()
             await database.add_messages(session_id, agent_run.result.new_messages_json(), user, agent_name)
 
-    return StreamingResponse(stream_messages(), media_type="text/plain")
+    return StreamingResponse(stream_messages(), media_type="text/plain", headers=_STREAM_HEADERS)
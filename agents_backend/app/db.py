@@ -1,27 +1,49 @@
 from __future__ import annotations as _annotations
 
 import asyncio
+import queue
 import sqlite3
-from collections.abc import AsyncIterator
-from concurrent.futures.thread import ThreadPoolExecutor
+import sys
+import threading
+from collections.abc import AsyncIterator, Iterable
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from datetime import datetime
-from functools import partial
 from pathlib import Path
-from typing import Any, Callable, TypeVar
+from typing import Any, Callable, LiteralString, ParamSpec, TypeVar
 
 from pydantic_ai.messages import (
     ModelMessage,
     ModelMessagesTypeAdapter,
 )
-from typing_extensions import LiteralString, ParamSpec, TypedDict
+
+# pydantic only accepts typing.TypedDict from 3.12 on, and Session is used as a response model
+if sys.version_info >= (3, 12):
+    from typing import TypedDict
+else:
+    from typing_extensions import TypedDict
 
 THIS_DIR = Path(__file__).parent
 
 
+# pydantic-ai defers building this adapter, do it at import rather than on the first request
+ModelMessagesTypeAdapter.rebuild()
+
 P = ParamSpec("P")
 R = TypeVar("R")
+Job = tuple["asyncio.Future[Any]", Callable[[], Any]]
+ReadJob = tuple["asyncio.Future[Any]", str, tuple[Any, ...]]
+
+
+MESSAGES_TABLE = """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        message_list BLOB NOT NULL,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE
+    );
+"""
 
 
 class Session(TypedDict):
@@ -34,34 +56,109 @@ class Session(TypedDict):
     agent_name: str
 
 
+def _join_message_lists(message_lists: Iterable[bytes]) -> bytes:
+    """Merge stored JSON arrays into a single array so it can be validated in one call"""
+    items = [inner for message_list in message_lists if (inner := message_list.strip()[1:-1].strip())]
+    return b"[" + b",".join(items) + b"]"
+
+
 @dataclass
 class Database:
     """Rudimentary database to store chat messages in SQLite.
 
     The SQLite standard library package is synchronous, so we
-    use a thread pool executor to run queries asynchronously.
+    run writes on a dedicated worker thread fed through a queue.
+    Reads are spread over a small pool of read-only connections,
+    each on its own thread, which WAL lets run alongside the writer.
     """
 
     con: sqlite3.Connection
     _loop: asyncio.AbstractEventLoop
-    _executor: ThreadPoolExecutor
+    _tx: queue.SimpleQueue[Job | None]
+    _thread: threading.Thread
+    _rx: queue.SimpleQueue[ReadJob | None]
+    _readers: list[threading.Thread]
 
     @classmethod
     @asynccontextmanager
-    async def connect(cls, file: Path = THIS_DIR / ".chat_app_messages.sqlite") -> AsyncIterator[Database]:
+    async def connect(
+        cls, file: Path = THIS_DIR / ".chat_app_messages.sqlite", readers: int = 4
+    ) -> AsyncIterator[Database]:
         loop = asyncio.get_event_loop()
-        executor = ThreadPoolExecutor(max_workers=1)
-        con = await loop.run_in_executor(executor, cls._connect, file)
-        slf = cls(con, loop, executor)
+        tx: queue.SimpleQueue[Job | None] = queue.SimpleQueue()
+        rx: queue.SimpleQueue[ReadJob | None] = queue.SimpleQueue()
+        thread = threading.Thread(target=cls._run, args=(loop, tx), name="sqlite-worker", daemon=True)
+        thread.start()
+        reader_threads: list[threading.Thread] = []
         try:
-            yield slf
+            future = loop.create_future()
+            tx.put((future, lambda: cls._connect(file)))
+            con = await future
+            slf = cls(con, loop, tx, thread, rx, reader_threads)
+            try:
+                # open the readers only once _connect has created and migrated the schema
+                for i in range(readers):
+                    reader_con = await slf._asyncify(cls._connect_reader, file)
+                    reader = threading.Thread(
+                        target=cls._run_reader, args=(loop, rx, reader_con), name=f"sqlite-reader-{i}", daemon=True
+                    )
+                    reader.start()
+                    reader_threads.append(reader)
+                yield slf
+            finally:
+                await slf._asyncify(con.close)
         finally:
-            await slf._asyncify(con.close)
+            tx.put(None)
+            for _ in reader_threads:
+                rx.put(None)
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop, tx: queue.SimpleQueue[Job | None]):
+        """Worker thread loop, runs jobs until the None sentinel is received"""
+        while (job := tx.get()) is not None:
+            future, func = job
+            try:
+                result = func()
+            except BaseException as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+            else:
+                loop.call_soon_threadsafe(_set_result, future, result)
+
+    @staticmethod
+    def _run_reader(loop: asyncio.AbstractEventLoop, rx: queue.SimpleQueue[ReadJob | None], con: sqlite3.Connection):
+        """Reader thread loop, answers queries on its own connection until the None sentinel is received"""
+        try:
+            while (job := rx.get()) is not None:
+                future, sql, args = job
+                try:
+                    rows = con.execute(sql, args).fetchall()
+                except BaseException as e:
+                    loop.call_soon_threadsafe(_set_exception, future, e)
+                else:
+                    loop.call_soon_threadsafe(_set_result, future, rows)
+        finally:
+            con.close()
+
+    @staticmethod
+    def _connect_reader(file: Path) -> sqlite3.Connection:
+        # handed over to its reader thread and only used there from then on
+        con = sqlite3.connect(str(file), check_same_thread=False, cached_statements=256)
+        con.execute("PRAGMA query_only=ON")
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.execute("PRAGMA cache_size=-64000")
+        con.execute("PRAGMA busy_timeout=30000")
+        return con
 
     @staticmethod
     def _connect(file: Path) -> sqlite3.Connection:
-        con = sqlite3.connect(str(file))
+        # all access goes through the single worker thread, so sharing the connection is safe
+        con = sqlite3.connect(str(file), check_same_thread=False, cached_statements=256)
         cur = con.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA cache_size=-64000")
+        cur.execute("PRAGMA busy_timeout=30000")
         # Create sessions table
         cur.execute("""
             CREATE TABLE IF NOT EXISTS sessions (
@@ -74,73 +171,80 @@ class Database:
             );
         """)
         # Update messages table to include session_id
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                message_list TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (session_id) REFERENCES sessions(id)
-            );
-        """)
+        cur.execute(MESSAGES_TABLE)
+        # Databases created before messages cascaded on session delete need their table rebuilt
+        if any(fk[6] != "CASCADE" for fk in cur.execute("PRAGMA foreign_key_list(messages)").fetchall()):
+            cur.executescript(f"""
+                BEGIN;
+                ALTER TABLE messages RENAME TO messages_old;
+                {MESSAGES_TABLE}
+                INSERT INTO messages (id, session_id, message_list, created_at)
+                    SELECT id, session_id, message_list, created_at FROM messages_old;
+                DROP TABLE messages_old;
+                COMMIT;
+            """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_lma ON sessions(username, last_message_at DESC);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(session_id, id);")
         con.commit()
+        cur.execute("PRAGMA foreign_keys=ON")
         return con
 
     async def add_messages(self, session_id: str, messages: bytes, username: str, agent_name: str):
-        # First, ensure the session exists
-        await self._ensure_session_exists(session_id, username, agent_name)
-
-        # Add the messages
-        await self._asyncify(
-            self._execute,
-            "INSERT INTO messages (session_id, message_list, created_at) VALUES (?, ?, ?);",
-            session_id,
-            messages,
-            datetime.utcnow().isoformat(),
-            commit=True,
-        )
+        await self._asyncify(self._add_messages_sync, session_id, messages, username, agent_name, datetime.utcnow())
 
-        # Update last_message_at for the session
-        await self._asyncify(
-            self._execute,
-            "UPDATE sessions SET last_message_at = ? WHERE id = ?;",
-            datetime.utcnow().isoformat(),
-            session_id,
-            commit=True,
-        )
-
-        await self._asyncify(self.con.commit)
+    def _add_messages_sync(self, session_id: str, messages: bytes, username: str, agent_name: str, now: datetime):
+        """Ensure the session exists, store the messages and bump last_message_at in one transaction"""
+        now_iso = now.isoformat()
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            c = self.con.execute(
+                """
+                INSERT INTO sessions (id, title, created_at, last_message_at, agent_name, username) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET last_message_at = excluded.last_message_at
+                WHERE sessions.username = excluded.username;
+                """,
+                (session_id, f"{agent_name} {now.strftime('%Y-%m-%d %H:%M')}", now_iso, now_iso, agent_name, username),
+            )
+            if not c.rowcount:
+                raise ValueError(f"Session {session_id} not found for user {username}")
+            self.con.execute(
+                "INSERT INTO messages (session_id, message_list, created_at) VALUES (?, ?, ?);",
+                (session_id, messages, now_iso),
+            )
+        except BaseException:
+            self.con.rollback()
+            raise
+        self.con.commit()
 
     async def get_messages(self, session_id: str, username: str) -> list[ModelMessage]:
-        c = await self._asyncify(
-            self._execute,
+        rows = await self._read(
             "SELECT message_list FROM messages m JOIN sessions s ON m.session_id = s.id WHERE s.id = ? AND s.username = ? ORDER BY m.id",
             session_id,
             username,
         )
-        rows = await self._asyncify(c.fetchall)
-        messages: list[ModelMessage] = []
-        for row in rows:
-            messages.extend(ModelMessagesTypeAdapter.validate_json(row[0]))
-        return messages
+        return ModelMessagesTypeAdapter.validate_json(_join_message_lists(row[0] for row in rows))
 
-    async def get_session_agent(self, session_id: str, username: str) -> str:
-        """Get the agent name for a specific session"""
-        c = await self._asyncify(
-            self._execute, "SELECT agent_name FROM sessions WHERE id = ? AND username = ?", session_id, username
+    async def get_session_context(self, session_id: str, username: str) -> tuple[str, list[ModelMessage]]:
+        """Get the agent name and message history of a session in a single query"""
+        rows = await self._read(
+            "SELECT s.agent_name, m.message_list FROM sessions s LEFT JOIN messages m ON m.session_id = s.id WHERE s.id = ? AND s.username = ? ORDER BY m.id",
+            session_id,
+            username,
         )
-        row = await self._asyncify(c.fetchone)
-        if not row:
+        if not rows:
             raise ValueError(f"Session {session_id} not found for user {username}")
-        return row[0]
+        agent_name = rows[0][0]
+        # a session without messages yields a single row with a NULL message_list
+        messages = ModelMessagesTypeAdapter.validate_json(
+            _join_message_lists(row[1] for row in rows if row[1] is not None)
+        )
+        return agent_name, messages
 
     async def get_sessions(self, username: str) -> list[Session]:
-        c = await self._asyncify(
-            self._execute,
+        rows = await self._read(
             "SELECT id, title, created_at, last_message_at, agent_name FROM sessions WHERE username = ? ORDER BY last_message_at DESC",
             username,
         )
-        rows = await self._asyncify(c.fetchall)
         sessions: list[Session] = []
         for row in rows:
             sessions.append(
@@ -156,65 +260,76 @@ class Database:
 
     async def delete_session(self, session_id: str, username: str) -> bool:
         """Delete a session and its messages"""
-        c = await self._asyncify(
-            self._execute, "SELECT id FROM sessions WHERE id = ? AND username = ?", session_id, username
-        )
-        if not await self._asyncify(c.fetchone):
-            return False  # Session does not exist or user does not have permission
-
         try:
-            # First delete all messages for this session
-            await self._asyncify(
-                self._execute,
-                "DELETE FROM messages WHERE session_id = ?",
-                session_id,
-                commit=True,
-            )
-
-            # Then delete the session
-            await self._asyncify(
-                self._execute,
-                "DELETE FROM sessions WHERE id = ?",
-                session_id,
-                commit=True,
-            )
-
-            return True
+            deleted = await self._asyncify(self._delete_session_sync, session_id, username)
         except Exception as e:
             print(f"Error deleting session: {e}")
             return False
 
+        return deleted  # False if the session does not exist or user does not have permission
+
+    def _delete_session_sync(self, session_id: str, username: str) -> bool:
+        # messages are removed by the ON DELETE CASCADE foreign key
+        c = self.con.execute("DELETE FROM sessions WHERE id = ? AND username = ? RETURNING id", (session_id, username))
+        deleted = c.fetchone() is not None
+        self.con.commit()
+        return deleted
+
     async def _ensure_session_exists(self, session_id: str, username: str, agent_name: str):
-        # Check if session exists
-        c = await self._asyncify(
-            self._execute, "SELECT id, agent_name FROM sessions WHERE id = ? AND username = ?", session_id, username
+        # Create the session with a default title unless it already exists
+        now = datetime.utcnow()
+        await self._asyncify(
+            self._execute,
+            "INSERT OR IGNORE INTO sessions (id, title, created_at, last_message_at, agent_name, username) VALUES (?, ?, ?, ?, ?, ?);",
+            session_id,
+            f"{agent_name} {now.strftime('%Y-%m-%d %H:%M')}",
+            now.isoformat(),
+            now.isoformat(),
+            agent_name,
+            username,
+            commit=True,
         )
-        row = await self._asyncify(c.fetchone)
-
-        if not row:
-            # Create new session with a default title
-            await self._asyncify(
-                self._execute,
-                "INSERT INTO sessions (id, title, created_at, last_message_at, agent_name, username) VALUES (?, ?, ?, ?, ?, ?);",
-                session_id,
-                f"{agent_name} {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}",
-                datetime.utcnow().isoformat(),
-                datetime.utcnow().isoformat(),
-                agent_name,
-                username,
-                commit=True,
-            )
 
     def _execute(self, sql: LiteralString, *args: Any, commit: bool = False) -> sqlite3.Cursor:
-        cur = self.con.cursor()
-        cur.execute(sql, args)
+        cur = self.con.execute(sql, args)
         if commit:
             self.con.commit()
         return cur
 
+    async def _read(self, sql: LiteralString, *args: Any) -> list[Any]:
+        """Run a SELECT on one of the reader connections and return all rows"""
+        if not self._readers:
+            return await self._asyncify(lambda: self._execute(sql, *args).fetchall())
+        future = self._loop.create_future()
+        self._rx.put((future, sql, args))
+        return await future
+
     async def _asyncify(self, func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
-        return await self._loop.run_in_executor(  # type: ignore
-            self._executor,
-            partial(func, **kwargs),
-            *args,  # type: ignore
-        )
+        future = self._loop.create_future()
+        self._tx.put((future, lambda: func(*args, **kwargs)))
+        return await future
+
+
+_database: Database | None = None
+
+
+def set_database(database: Database | None):
+    """Register the database opened in the app lifespan for get_database"""
+    global _database
+    _database = database
+
+
+def get_database() -> Database:
+    if _database is None:
+        raise RuntimeError("Database is not connected")
+    return _database
+
+
+def _set_result(future: asyncio.Future[Any], result: Any):
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future[Any], exc: BaseException):
+    if not future.cancelled():
+        future.set_exception(exc)
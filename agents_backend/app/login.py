@@ -1,10 +1,13 @@
+import asyncio
+import hashlib
 import logging
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional
 
 import jwt
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.security.utils import get_authorization_scheme_param
 from google.auth.transport import requests as google_requests
@@ -16,6 +19,8 @@ from starlette.status import HTTP_401_UNAUTHORIZED
 
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     tags=["login"],
 )
@@ -23,6 +28,9 @@ router = APIRouter(
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+_VALID_ISSUERS = frozenset({"accounts.google.com", "https://accounts.google.com"})
+verify_google_token = id_token.verify_oauth2_token
+
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -35,12 +43,13 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt takes hundreds of milliseconds, keep it off the event loop
+async def verify_password(plain_password, hashed_password):
+    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await asyncio.to_thread(pwd_context.hash, password)
 
 
 class GoogleTokenRequest(BaseModel):
@@ -58,12 +67,10 @@ async def google_auth(token_request: GoogleTokenRequest):
     """Verify Google ID token and authenticate user"""
     try:
         # Verify the Google ID token
-        idinfo = id_token.verify_oauth2_token(
-            token_request.credential, google_requests.Request(), settings.GOOGLE_CLIENT_ID
-        )
+        idinfo = verify_google_token(token_request.credential, google_requests.Request(), settings.GOOGLE_CLIENT_ID)
 
         # Verify the issuer
-        if idinfo["iss"] not in ["accounts.google.com", "https://accounts.google.com"]:
+        if idinfo["iss"] not in _VALID_ISSUERS:
             raise ValueError("Wrong issuer.")
 
         # Get user info from the token
@@ -102,7 +109,7 @@ async def google_auth(token_request: GoogleTokenRequest):
             "user": {"username": username, "email": email, "full_name": name},
         }
 
-        response = JSONResponse(content=response_data)
+        response = ORJSONResponse(content=response_data)
 
         # Set the cookie
         cookie_max_age = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
@@ -148,13 +155,11 @@ class OAuth2PasswordBearerWithCookieOrHeader(OAuth2PasswordBearer):
         cookie_name: str = "access-token",
     ):
         self.cookie_name = cookie_name
+        # Try all possible cookie names for backward compatibility
+        self._cookie_names = (cookie_name, "access_token_cookie", "access_token")
         super().__init__(tokenUrl=tokenUrl, scheme_name=scheme_name, scopes=scopes, auto_error=auto_error)
 
     async def __call__(self, request: Request) -> Optional[str]:
-        # Get logger for this method - this is acceptable as it's a framework method
-        # and can't easily receive dependency injection
-        logger = logging.getLogger(__name__)
-
         # Log the request headers and cookies for debugging
         # logger.info(f"Auth Headers: {dict(request.headers)}")
         # logger.info(f"Auth Cookies: {dict(request.cookies)}")
@@ -167,10 +172,7 @@ class OAuth2PasswordBearerWithCookieOrHeader(OAuth2PasswordBearer):
                 logger.info(f"Found bearer token in header: {param[:10]}...")
                 return param
 
-        # Try all possible cookie names for backward compatibility
-        cookie_names = [self.cookie_name, "access_token_cookie", "access_token"]
-
-        for cookie_name in cookie_names:
+        for cookie_name in self._cookie_names:
             cookie_authorization = request.cookies.get(cookie_name)
             if cookie_authorization:
                 # logger.info(f"Found authorization in cookie '{cookie_name}': {cookie_authorization[:10]}...")
@@ -208,10 +210,33 @@ oauth2_scheme = OAuth2PasswordBearerWithCookieOrHeader(tokenUrl="token", auto_er
 TokenDep = Annotated[str, Depends(oauth2_scheme)]
 
 
+# blake2b digest of a verified token -> (exp, username), so each token is decoded once until it expires
+_token_cache: dict[bytes, tuple[float, str]] = {}
+TOKEN_CACHE_SIZE = 10_000
+
+
+def _cache_token(key: bytes, exp: float, username: str):
+    if len(_token_cache) >= TOKEN_CACHE_SIZE:
+        now = time.time()
+        for expired in [k for k, (k_exp, _) in _token_cache.items() if k_exp <= now]:
+            del _token_cache[expired]
+        if len(_token_cache) >= TOKEN_CACHE_SIZE:
+            _token_cache.clear()
+    _token_cache[key] = (exp, username)
+
+
 async def get_current_user(token: TokenDep):
     if not token:
         raise NotAuthenticatedException
 
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        exp, username = cached
+        if exp > time.time():
+            return username
+        _token_cache.pop(key, None)
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
 
@@ -223,6 +248,8 @@ async def get_current_user(token: TokenDep):
     except InvalidTokenError as e:
         raise NotAuthenticatedException from e
 
+    if "exp" in payload:
+        _cache_token(key, payload["exp"], username)
     return token_data.username
 
 
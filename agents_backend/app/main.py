@@ -1,47 +1,82 @@
+"""ASGI entrypoint.
+
+Served by uvicorn with one worker process per core, ``--loop uvloop --http httptools``
+(see the Dockerfile). Each worker opens its own SQLite connections, so writes from
+different workers are serialized by SQLite's lock and ``busy_timeout``.
+"""
+
 from __future__ import annotations as _annotations
 
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
 import fastapi
 from fastapi import Request
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
+from starlette.types import Receive, Scope, Send
 
 from app.core import router as core_router
-from app.db import Database
-from app.login import CurrentUser, NotAuthenticatedException
+from app.cors import FastCORS
+from app.db import Database, set_database
+from app.login import NotAuthenticatedException, get_current_user, oauth2_scheme
 from app.login import router as login_router
 
 
 @asynccontextmanager
 async def lifespan(_app: fastapi.FastAPI):
+    # routes build their dependants and response fields when they are registered,
+    # the OpenAPI schema is the one piece FastAPI generates lazily on first request
+    _app.openapi()
     async with Database.connect() as db:
-        _app.state.db = db
-        yield
-        delattr(_app.state, "db")
+        set_database(db)
+        try:
+            yield
+        finally:
+            set_database(None)
+
+
+class StreamingAwareGZip(GZipMiddleware):
+    """GZip for everything but the chat stream.
+
+    Frames of ``POST /chat/`` would sit in the compressor buffer instead of reaching the
+    browser as the model produces them, so that route bypasses compression.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/chat/":
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
 
-app = fastapi.FastAPI(lifespan=lifespan)
+app = fastapi.FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(login_router)
 app.include_router(core_router)
 # Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # Next.js default port
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],  # Explicitly specify DELETE
-    allow_headers=["*"],
-)
+app.add_middleware(FastCORS)
+# Added last so it wraps FastCORS, compressed responses still carry the CORS headers
+app.add_middleware(StreamingAwareGZip, minimum_size=1024)
+
+
+@lru_cache(maxsize=10_000)
+def _greeting(username: str) -> str:
+    return f"Hello, {username}!"
+
+
+async def index(request: Request) -> PlainTextResponse:
+    # a plain Starlette route skips FastAPI's dependency solving, so authenticate by hand
+    user = await get_current_user(await oauth2_scheme(request))
+    return PlainTextResponse(_greeting(user))
+
+
+app.add_route("/", index, methods=["GET"])
 
 
-@app.get("/")
-async def index(user: CurrentUser) -> str:
-    return f"Hello, {user}!"
+_NOT_AUTHENTICATED_BODY = b'{"detail":"Not authenticated"}'
 
 
 @app.exception_handler(NotAuthenticatedException)
 async def not_authenticated_exception_handler(request: Request, exc: NotAuthenticatedException):
-    return JSONResponse(
-        status_code=401,
-        content={"detail": "Not authenticated"},
-    )
+    # a new Response each time: middlewares may edit the header list of the response in place
+    return Response(content=_NOT_AUTHENTICATED_BODY, status_code=401, media_type="application/json")